@@ -1,20 +1,27 @@
 import os
+import re
 import time
 import logging
-from typing import Dict, List, Optional, Union, Any
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple, Union, Any
 from enum import Enum
-from functools import lru_cache
 
 # Anki dependencies
 from anki import hooks
-from anki.notes import Note
-from anki.template import TemplateRenderContext, TemplateRenderOutput
-from aqt import mw
+from anki.collection import Collection
+from anki.consts import MODEL_CLOZE
+from anki.utils import ids2str, split_fields
+from anki.template import TemplateRenderContext
+from aqt import gui_hooks, mw
+from aqt.browser.previewer import Previewer
+from aqt.clayout import CardLayout
+from aqt.reviewer import Reviewer
 from aqt.utils import showWarning
+from aqt.webview import WebContent
 
 # Custom module imports
-from .static import html, css
-from .util import is_kanji
+from .static import css, render_html
+from .util import KANJI_RE
 
 # Set up logging
 logging.basicConfig(
@@ -34,7 +41,6 @@ try:
     config = mw.addonManager.getConfig(__name__)
     KANJI_FILTER = config.get("kanji_filter", "my_kanji")
     KANJI_DECK = config.get("kanji_deck", "WaniKani Ultimate::Kanjis")
-    CACHE_SIZE = config.get("cache_size", 1000)
     DEBUG_MODE = config.get("debug_mode", False)
 
     if DEBUG_MODE:
@@ -48,7 +54,6 @@ except Exception as e:
     logger.error(f"Error loading config: {str(e)}")
     KANJI_FILTER = "my_kanji"
     KANJI_DECK = "WaniKani Ultimate::Kanjis"
-    CACHE_SIZE = 1000
     DEBUG_MODE = False
 
     if mw:
@@ -79,6 +84,17 @@ class SubjectError(Enum):
 class KanjiData:
     """Data class to store kanji information."""
 
+    __slots__ = (
+        "character",
+        "meaning",
+        "onyomi",
+        "kunyomi",
+        "meaning_mnemonic",
+        "reading_mnemonic",
+        "radicals",
+        "level",
+    )
+
     def __init__(self, data: Dict[str, str]):
         self.character = data.get("character", "")
         self.meaning = data.get("meaning", "")
@@ -87,75 +103,112 @@ class KanjiData:
         self.meaning_mnemonic = data.get("meaning_mnemonic", "")
         self.reading_mnemonic = data.get("reading_mnemonic", "")
         self.radicals = data.get("radicals", "")
+        self.level = data.get("level", "0")
 
     def is_valid(self) -> bool:
         """Check if the kanji data is valid and usable."""
         return bool(self.character and self.meaning)
 
 
-def query_by_field_name(
-    field_name: str, search_term: str, deck_name: str
-) -> List[Note]:
+# Matches the WaniKani level in tags such as "level42"
+LEVEL_TAG_RE = re.compile(r"level(\d+)")
+
+# Name of the field holding the character in kanji notes
+KANJI_FIELD = "Kanji"
+
+# A note as stored in the collection: (fields, tags)
+NoteRow = Tuple[List[str], List[str]]
+
+
+def _deck_note_rows(col: Collection, deck_name: str) -> List[List[Any]]:
     """
-    Search for notes using field names within a specified deck.
+    Read raw note rows from a deck (including its subdecks and cards currently
+    in filtered decks) with a single SQL query.
+    This skips the search parser and Note construction entirely.
 
     Args:
-        field_name: The name of the field to search in
-        search_term: The term to search for
-        deck_name: The name of the deck to search in
+        col: The collection to read from
+        deck_name: The name of the deck to read
 
     Returns:
-        A list of matching notes
+        A list of [mid, flds, tags] rows
     """
-    notes = []
-    try:
-        if not mw or not mw.col:
-            logger.error("Collection not available")
-            return notes
+    deck_id = col.decks.id_for_name(deck_name)
+    if not deck_id:
+        logger.warning(f"Deck not found: {deck_name}")
+        return []
+
+    deck_ids = ids2str(col.decks.deck_and_child_ids(deck_id))
+    # Cards moved into a filtered deck keep their home deck in odid
+    sql = (
+        "SELECT mid, flds, tags FROM notes WHERE id IN "
+        f"(SELECT nid FROM cards WHERE did IN {deck_ids} "
+        f"OR (odid != 0 AND odid IN {deck_ids}))"
+    )
+    logger.debug("Executing query: %s", sql)
+    return col.db.all(sql)
 
-        # First check if the deck exists
-        deck_id = mw.col.decks.id(deck_name)
-        if not deck_id:
-            logger.warning(f"Deck not found: {deck_name}")
-            return notes
 
-        # Perform the search
-        query = f'deck:"{deck_name}" {field_name}:*{search_term}*'
-        logger.debug(f"Executing query: {query}")
-        note_ids = mw.col.find_notes(query)
+# Every kanji of KANJI_DECK keyed by character, None until loaded
+KANJI_TABLE: Optional[Dict[str, KanjiData]] = None
 
-        # Get the matching notes
-        for nid in note_ids:
-            note = mw.col.get_note(nid)
-            if field_name in note and search_term in note[field_name]:
-                notes.append(note)
+# Bumped whenever KANJI_TABLE is reloaded or dropped, so that a background
+# read started before then is not installed over the newer table
+_TABLE_GENERATION = 0
 
-        logger.debug(
-            f"Found {len(notes)} notes matching '{search_term}' in {field_name}"
+# Rendered tooltip per kanji, valid for the currently loaded KANJI_TABLE
+_HTML_CACHE: Dict[str, str] = {}
+
+
+def _kanji_data_from_row(slug: str, row: NoteRow) -> Union[KanjiData, SubjectError]:
+    """
+    Extract kanji data from a note of the kanji deck.
+
+    Args:
+        slug: The kanji character the note belongs to
+        row: The matching (fields, tags) tuple
+
+    Returns:
+        KanjiData or SubjectError
+    """
+    fields, arr = row
+    level = next((m.group(1) for m in map(LEVEL_TAG_RE.search, arr) if m), "0")
+
+    # Extract kanji data - adjust indices based on your note type
+    try:
+        return KanjiData(
+            {
+                "character": slug,
+                "meaning": fields[1],
+                "onyomi": fields[2],
+                "kunyomi": fields[3],
+                "meaning_mnemonic": fields[8] + "</br></br>" + fields[9],
+                "reading_mnemonic": fields[10] + "</br></br>" + fields[11],
+                "radicals": fields[4] + "|" + fields[6],
+                "level": level,
+            }
         )
-        return notes
 
-    except Exception as e:
-        logger.error(f"Error in query_by_field_name: {str(e)}")
-        return notes
+    except IndexError as e:
+        logger.error(f"Field index error for kanji {slug}: {str(e)}")
+        return SubjectError.INVALID_SLUG
 
 
-@lru_cache(maxsize=CACHE_SIZE)
 def get_subject_by_slug(
     subject_type: SubjectType, slug: str
-) -> Union[Dict[str, str], SubjectError]:
+) -> Union[KanjiData, SubjectError]:
     """
     Retrieve subject information by its slug (character).
-    Uses caching to improve performance.
+    Lookups are served from the preloaded kanji table.
 
     Args:
         subject_type: The type of subject (kanji, vocabulary, radical)
         slug: The unique identifier for the subject (character for kanji)
 
     Returns:
-        Dictionary with subject data or SubjectError
+        KanjiData with subject data or SubjectError
     """
-    logger.debug(f"Looking up: type={subject_type}, slug={slug}")
+    logger.debug("Looking up: type=%s, slug=%s", subject_type, slug)
 
     if not slug:
         return SubjectError.INVALID_SLUG
@@ -165,50 +218,158 @@ def get_subject_by_slug(
         logger.warning(f"Unsupported subject type: {subject_type}")
         return SubjectError.INVALID_SLUG
 
-    # Check for deck existence
-    if not mw.col.decks.id(KANJI_DECK):
-        logger.error(f"Kanji deck not found: {KANJI_DECK}")
-        return SubjectError.DECK_NOT_FOUND
+    table = _kanji_table()
+    if table is None:
+        return SubjectError.BAD_CONNECTION
 
-    # Search for the kanji in the specified deck
-    start_time = time.time()
-    notes = query_by_field_name("Kanji", slug, KANJI_DECK)
-    query_time = time.time() - start_time
+    return table.get(slug, SubjectError.NO_RESULTS)
 
-    if not notes:
-        logger.info(f"No results found for kanji: {slug}")
-        return SubjectError.NO_RESULTS
 
-    # Use the first matching note
-    note = notes[0]
+def _read_kanji_table(col: Collection) -> Dict[str, KanjiData]:
+    """
+    Read every note of the kanji deck with a single query.
+    Safe to run on a background thread, as it only touches the given collection.
 
-    arr = note.tags
-    level = "0"
-    for a in arr:
-        if "level" in a:
-            split = a.split("level")
-            if len(split) > 0:
-                level = split[1]
+    Args:
+        col: The collection to read from
+
+    Returns:
+        Dictionary mapping each kanji to its data
+    """
+    start_time = time.perf_counter()
+    table: Dict[str, KanjiData] = {}
+
+    # Index of the Kanji field per note type, None for other note types
+    kanji_fields: Dict[int, Optional[int]] = {}
+
+    for mid, flds, tags in _deck_note_rows(col, KANJI_DECK):
+        if mid not in kanji_fields:
+            entry = col.models.field_map(col.models.get(mid)).get(KANJI_FIELD)
+            kanji_fields[mid] = entry[0] if entry else None
+
+        index = kanji_fields[mid]
+        if index is None:
+            continue
+
+        fields = split_fields(flds)
+        slug = fields[index].strip()
+        if not slug or slug in table:
+            continue
+
+        kanji_data = _kanji_data_from_row(slug, (fields, tags.split()))
+        if not isinstance(kanji_data, SubjectError):
+            table[slug] = kanji_data
+
+    load_time = time.perf_counter() - start_time
+    logger.info(f"Loaded {len(table)} kanji from {KANJI_DECK} in {load_time:.3f}s")
+    return table
+
+
+def load_kanji_table() -> None:
+    """
+    Load every note of the kanji deck into KANJI_TABLE.
+    The deck is small enough to keep in memory, so lookups never hit the database.
+    If reading the deck fails, an empty table is kept until caches are cleared or
+    the profile is reopened.
+    """
+    global KANJI_TABLE, _TABLE_GENERATION
+    _TABLE_GENERATION += 1
 
-    # Extract kanji data - adjust indices based on your note type
     try:
-        kanji_data = {
-            "character": slug,
-            "meaning": note.fields[1],
-            "onyomi": note.fields[2],
-            "kunyomi": note.fields[3],
-            "meaning_mnemonic": note.fields[8] + "</br></br>" + note.fields[9],
-            "reading_mnemonic": note.fields[10] + "</br></br>" + note.fields[11],
-            "radicals": note.fields[4] + "|" + note.fields[6],
-            "level": level,
-        }
-
-        logger.debug(f"Retrieved kanji data for {slug} in {query_time:.3f}s")
-        return kanji_data
+        if not mw or not mw.col:
+            logger.error("Collection not available")
+            return
+
+        KANJI_TABLE = _read_kanji_table(mw.col)
+
+    except Exception as e:
+        # Keep an empty table so a broken deck is not re-read on every render
+        logger.error(f"Error loading kanji table: {str(e)}")
+        KANJI_TABLE = {}
+
+    _HTML_CACHE.clear()
+
+
+def _kanji_table() -> Optional[Dict[str, KanjiData]]:
+    """
+    Return the kanji table, loading it first if the preload has not finished yet.
+
+    Returns:
+        The kanji table, or None if it could not be loaded
+    """
+    if KANJI_TABLE is None:
+        load_kanji_table()
+    return KANJI_TABLE
+
+
+def preload_kanji_table() -> None:
+    """Load the kanji table in the background so opening the profile is not blocked."""
+    col = mw.col
+    generation = _TABLE_GENERATION
+    mw.taskman.run_in_background(
+        lambda: _read_kanji_table(col),
+        lambda future: _on_kanji_table_read(col, generation, future),
+    )
+
+
+def _on_kanji_table_read(col: Collection, generation: int, future: Future) -> None:
+    """
+    Install the kanji table read by preload_kanji_table.
+    This function is called on the main thread once the background task is done.
+
+    Args:
+        col: The collection the table was read from
+        generation: The value of _TABLE_GENERATION when the read started
+        future: The finished background task
+    """
+    global KANJI_TABLE
+
+    # The profile may have been closed or switched, or the table reloaded,
+    # while the table was loading
+    if mw.col is not col or generation != _TABLE_GENERATION:
+        return
+
+    try:
+        table = future.result()
+    except Exception as e:
+        # Keep an empty table so a broken deck is not re-read on every render
+        logger.error(f"Error loading kanji table: {str(e)}")
+        table = {}
+
+    KANJI_TABLE = table
+    _HTML_CACHE.clear()
 
-    except IndexError as e:
-        logger.error(f"Field index error for kanji {slug}: {str(e)}")
-        return SubjectError.INVALID_SLUG
+
+def _render_hint(table: Dict[str, KanjiData], char: str) -> str:
+    """
+    Render the tooltip for a single kanji.
+
+    Args:
+        table: The kanji table to look the character up in
+        char: The kanji character
+
+    Returns:
+        The tooltip HTML, or the character itself if it has no data
+    """
+    kanji_data = table.get(char)
+
+    # Handle missing data
+    if kanji_data is None:
+        logger.debug("Kanji lookup error for %s: %s", char, SubjectError.NO_RESULTS)
+        return char
+
+    # Format the HTML tooltip
+    return render_html(
+        text=char,
+        link=f"https://wanikani.com/kanji/{char}",
+        meaning=kanji_data.meaning,
+        component_list=kanji_data.radicals,
+        meaning_mnemonic=kanji_data.meaning_mnemonic,
+        reading_mnemonic=kanji_data.reading_mnemonic,
+        onyomi=kanji_data.onyomi,
+        kunyomi=kanji_data.kunyomi,
+        level=kanji_data.level,
+    )
 
 
 def prepare_kanji_hint(text: str) -> str:
@@ -221,51 +382,52 @@ def prepare_kanji_hint(text: str) -> str:
     Returns:
         HTML-formatted text with kanji tooltips
     """
-    if not text:
+    # Only load the table for text that actually contains kanji
+    if not text or not KANJI_RE.search(text):
+        return text
+
+    table = _kanji_table()
+    if table is None:
         return text
 
-    output = ""
+    parts: List[str] = []
     kanji_count = 0
     error_count = 0
 
-    start_time = time.time()
+    if DEBUG_MODE:
+        start_time = time.perf_counter()
 
-    for char in text:
-        # Skip non-kanji characters
-        if not is_kanji(char):
-            output += char
-            continue
+    last = 0
 
+    for match in KANJI_RE.finditer(text):
+        # Copy the text between kanji as a single slice
+        parts.append(text[last : match.start()])
+        last = match.end()
+        char = match.group()
         kanji_count += 1
-        kanji_data = get_subject_by_slug(SubjectType.KANJI, char)
 
-        # Handle errors or missing data
-        if isinstance(kanji_data, SubjectError):
-            logger.debug(f"Kanji lookup error for {char}: {kanji_data}")
+        # Look up and render each distinct kanji only once
+        hint = _HTML_CACHE.get(char)
+        if hint is None:
+            hint = _HTML_CACHE[char] = _render_hint(table, char)
+
+        # Missing kanji are cached as the bare character
+        if hint == char:
             error_count += 1
-            output += char
-            continue
 
-        # Format the HTML tooltip
-        output += html.format(
-            text=char,
-            link=f"https://wanikani.com/kanji/{char}",
-            meaning=kanji_data["meaning"],
-            component_list=kanji_data["radicals"],
-            meaning_mnemonic=kanji_data["meaning_mnemonic"],
-            reading_mnemonic=kanji_data["reading_mnemonic"],
-            onyomi=kanji_data["onyomi"],
-            kunyomi=kanji_data["kunyomi"],
-            level=kanji_data["level"],
-        )
+        parts.append(hint)
 
-    process_time = time.time() - start_time
-    if kanji_count > 0:
+    parts.append(text[last:])
+
+    if DEBUG_MODE and kanji_count > 0:
         logger.debug(
-            f"Processed {kanji_count} kanji ({error_count} errors) in {process_time:.3f}s"
+            "Processed %d kanji (%d errors) in %.3fs",
+            kanji_count,
+            error_count,
+            time.perf_counter() - start_time,
         )
 
-    return output
+    return "".join(parts)
 
 
 def on_field_filter(
@@ -284,7 +446,9 @@ def on_field_filter(
     Returns:
         Processed text with kanji hints if the filter matches
     """
-    # Only process if our filter is being used
+    # Only process if our filter is being used. Filter names are built fresh
+    # by the template renderer, so this must stay an equality check; it
+    # already returns early on identity or a length mismatch.
     if filter_name != KANJI_FILTER:
         return text
 
@@ -296,22 +460,25 @@ def on_field_filter(
         return text
 
 
-def on_card_render(
-    output: TemplateRenderOutput, context: TemplateRenderContext
-) -> None:
+# Webviews that display rendered cards
+CARD_WEBVIEW_CONTEXTS = (Reviewer, Previewer, CardLayout)
+
+
+def on_webview_will_set_content(web_content: WebContent, context: Any) -> None:
     """
-    Add CSS to rendered cards.
-    This function is called by Anki after a card is rendered.
+    Add CSS to webviews that show cards.
+    This function is called by Anki once when a webview page is set up,
+    so the stylesheet is not repeated in every rendered card.
 
     Args:
-        output: The rendered card output
-        context: The render context
+        web_content: The content of the page being set up
+        context: The object owning the webview
     """
+    if not isinstance(context, CARD_WEBVIEW_CONTEXTS):
+        return
+
     try:
-        # Apply CSS to both question and answer sides
-        headers = f"<style>{css}</style>"
-        output.question_text = headers + output.question_text
-        output.answer_text = headers + output.answer_text
+        web_content.head += f"<style>{css}</style>"
     except Exception as e:
         logger.error(f"Error injecting CSS: {str(e)}")
 
@@ -331,26 +498,37 @@ def get_deck_contents(deck_name: str) -> Optional[List[Dict[str, Any]]]:
         logger.error("Collection not available")
         return None
 
-    deck_id = mw.col.decks.id(deck_name)
+    deck_id = mw.col.decks.id_for_name(deck_name)
     if not deck_id:
         logger.warning(f"Deck not found: {deck_name}")
         return None
 
     try:
-        card_ids = mw.col.decks.cids(deck_id)
+        # Read every card with its note in one query instead of loading objects
+        rows = mw.col.db.all(
+            "SELECT c.id, c.ord, n.id, n.mid, n.flds FROM cards c "
+            "JOIN notes n ON c.nid = n.id WHERE c.did = ?",
+            deck_id,
+        )
+        note_types: Dict[int, Dict[str, Any]] = {}
         deck_contents = []
 
-        for card_id in card_ids:
-            card = mw.col.get_card(card_id)
-            note = card.note()
+        for card_id, card_ord, note_id, mid, flds in rows:
+            if mid not in note_types:
+                note_types[mid] = mw.col.models.get(mid)
+            note_type = note_types[mid]
+
+            # Cloze cards all share the first template
+            templates = note_type["tmpls"]
+            template = templates[0 if note_type["type"] == MODEL_CLOZE else card_ord]
 
             deck_contents.append(
                 {
                     "card_id": card_id,
-                    "note_id": note.id,
-                    "fields": note.fields,
-                    "note_type": note.note_type()["name"],
-                    "card_template": card.template()["name"],
+                    "note_id": note_id,
+                    "fields": split_fields(flds),
+                    "note_type": note_type["name"],
+                    "card_template": template["name"],
                 }
             )
 
@@ -362,17 +540,32 @@ def get_deck_contents(deck_name: str) -> Optional[List[Dict[str, Any]]]:
 
 
 def clear_caches() -> None:
-    """Clear all function caches."""
-    get_subject_by_slug.cache_clear()
+    """Clear all caches and reload the kanji table."""
+    global KANJI_TABLE, _TABLE_GENERATION
+    _TABLE_GENERATION += 1
+    KANJI_TABLE = None
+    _HTML_CACHE.clear()
+    load_kanji_table()
     logger.info("Caches cleared")
 
 
+def unload_kanji_table() -> None:
+    """Drop the kanji table when the profile closes."""
+    global KANJI_TABLE, _TABLE_GENERATION
+    _TABLE_GENERATION += 1
+    KANJI_TABLE = None
+    _HTML_CACHE.clear()
+
+
 # Register with Anki hooks
 def init_plugin():
     """Initialize the plugin by registering necessary hooks."""
     try:
         hooks.field_filter.append(on_field_filter)
-        hooks.card_did_render.append(on_card_render)
+        gui_hooks.webview_will_set_content.append(on_webview_will_set_content)
+        # The collection is not open yet when add-ons are imported
+        gui_hooks.profile_did_open.append(preload_kanji_table)
+        gui_hooks.profile_will_close.append(unload_kanji_table)
         logger.info("Kanji plugin initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize plugin: {str(e)}")
@@ -1,3 +1,6 @@
+from string import Formatter
+from typing import Callable, Dict
+
 html = """<div class="tooltip">{text}<div class="tooltip-bottom">
         <div class="between">
             <a href="{link}" class="normal">
@@ -24,6 +27,33 @@ html = """<div class="tooltip">{text}<div class="tooltip-bottom">
     </div>
 </div>"""
 
+# The tooltip template split once into (literal, field name) pairs
+_HTML_PARTS = [(literal, field) for literal, field, _, _ in Formatter().parse(html)]
+
+
+def _compile_renderer() -> Callable[..., str]:
+    """
+    Generate a function that fills the tooltip template with a single f-string,
+    taking each template field as a keyword argument.
+    """
+    fields = list(dict.fromkeys(field for _, field in _HTML_PARTS if field))
+    pieces = []
+    for literal, field in _HTML_PARTS:
+        if literal:
+            pieces.append("f" + repr(literal.replace("{", "{{").replace("}", "}}")))
+        if field:
+            pieces.append(f"f'{{{field}}}'")
+
+    source = f"def render_html(*, {', '.join(fields)}):\n"
+    source += f"    return ({' '.join(pieces)})\n"
+    namespace: Dict[str, Callable[..., str]] = {}
+    exec(compile(source, "<tooltip template>", "exec"), namespace)
+    return namespace["render_html"]
+
+
+render_html = _compile_renderer()
+
+
 css = """
 .tooltip {
     display:inline-block;
@@ -1,3 +1,20 @@
+import re
+
+# Unicode ranges treated as kanji (courtesy of https://github.com/midse/anki-kakijun)
+KANJI_RANGES = (
+    (0x4E00, 0x9FC3),
+    (0x3400, 0x4DBF),
+    (0xF900, 0xFAD9),
+    (0x2E80, 0x2EFF),
+    (0x20000, 0x2A6DF),
+)
+
+# Matches a single kanji, for scanning text without a Python-level loop
+KANJI_RE = re.compile(
+    "[" + "".join(f"{chr(start)}-{chr(end)}" for start, end in KANJI_RANGES) + "]"
+)
+
+
 def is_kanji(c: str) -> bool:
     """
     Tests whether a provided character is a kanji or not
@@ -9,11 +26,4 @@ def is_kanji(c: str) -> bool:
     Returns:
         bool: true if kanji, false if not
     """
-    c = ord(c)
-    return (
-        (c >= 0x4E00 and c <= 0x9FC3)
-        or (c >= 0x3400 and c <= 0x4DBF)
-        or (c >= 0xF900 and c <= 0xFAD9)
-        or (c >= 0x2E80 and c <= 0x2EFF)
-        or (c >= 0x20000 and c <= 0x2A6DF)
-    )
+    return KANJI_RE.fullmatch(c) is not None